@@ -1,15 +1,153 @@
 # scripts/archive_datasets.py
 
 import os
+import zlib
 import zipfile
 import argparse
 import logging
+from collections import deque
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
+from functools import partial
+
+# ISA-L is an optional, faster Deflate backend used by --fast_deflate.
+try:
+    from isal import isal_zlib
+except ImportError:
+    isal_zlib = None
 
 # --- Configuration ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def archive_datasets(source_dir: str, output_dir: str):
+# Files up to this size are compressed on worker threads and held in memory until
+# the writer adds them. Larger files are streamed into the archive by the writer.
+MAX_PRECOMPRESSED_FILE_SIZE = 16 << 20
+
+# Upper bound on the total size of the files being compressed ahead of the writer,
+# so memory use stays bounded in bytes, not just in number of files.
+PRECOMPRESS_WINDOW_BYTES = 128 << 20
+
+class _PassThroughCompressor:
+    """A stand-in compressor for entries whose data is already Deflate-compressed."""
+
+    def compress(self, data):
+        return data
+
+    def flush(self):
+        return b''
+
+def _compress_file(file_path: str, archive_file_path: str, compressobj: Callable) -> tuple[zipfile.ZipInfo, bytes, int, int]:
+    """
+    Deflates a file and computes its CRC. Runs on a worker thread.
+
+    zlib releases the GIL while compressing and checksumming, so several files
+    are compressed in parallel.
+
+    Returns:
+        tuple[zipfile.ZipInfo, bytes, int, int]: The entry metadata, the raw
+        Deflate data, and the CRC-32 and size of the original file.
+    """
+    zinfo = zipfile.ZipInfo.from_file(file_path, archive_file_path)
+    compressor = compressobj()
+    crc = 0
+    file_size = 0
+    parts = []
+    with open(file_path, 'rb') as f:
+        while block := f.read(1 << 20):
+            crc = zlib.crc32(block, crc)
+            file_size += len(block)
+            parts.append(compressor.compress(block))
+    parts.append(compressor.flush())
+    return zinfo, b''.join(parts), crc, file_size
+
+def _write_precompressed(zipf: zipfile.ZipFile, zinfo: zipfile.ZipInfo, data: bytes, crc: int, file_size: int):
+    """
+    Adds an entry whose Deflate data and CRC were computed beforehand.
+
+    zipfile has no public API for this, so the entry is opened for writing
+    with a pass-through compressor, and the CRC and size of the original file
+    are filled in before it is closed and its header is finalised.
+    """
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    # zipfile sizes the entry's header from file_size.
+    zinfo.file_size = file_size
+    original_get_compressor = zipfile._get_compressor
+    zipfile._get_compressor = lambda *args: _PassThroughCompressor()
+    try:
+        dest = zipf.open(zinfo, 'w')
+    finally:
+        zipfile._get_compressor = original_get_compressor
+    with dest:
+        dest.write(data)
+        dest._crc = crc
+        dest._file_size = file_size
+
+def _iter_compressed_files(file_pairs: list[tuple[str, str]], compressobj: Callable, max_workers: int) -> Iterator[tuple[str, str, tuple | None]]:
+    """
+    Compresses files on a thread pool and yields them in their original order.
+
+    Only files up to MAX_PRECOMPRESSED_FILE_SIZE are compressed ahead of the
+    writer, and at most PRECOMPRESS_WINDOW_BYTES of them at a time.
+
+    Args:
+        file_pairs (list[tuple[str, str]]): (file_path, archive_file_path) pairs.
+        compressobj (Callable): Creates a raw Deflate compressor.
+        max_workers (int): The number of compression threads.
+
+    Yields:
+        tuple[str, str, tuple | None]: The file path, its path in the archive,
+        and the result of _compress_file(), or None for a file that is too
+        large and should be streamed into the archive instead.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        pending_bytes = 0
+        for file_path, archive_file_path in file_pairs:
+            file_size = os.path.getsize(file_path)
+            if file_size > MAX_PRECOMPRESSED_FILE_SIZE:
+                future, file_size = None, 0
+            else:
+                future = executor.submit(_compress_file, file_path, archive_file_path, compressobj)
+            pending.append((file_path, archive_file_path, future, file_size))
+            pending_bytes += file_size
+            while pending_bytes > PRECOMPRESS_WINDOW_BYTES or len(pending) > max_workers * 2:
+                file_path, archive_file_path, future, file_size = pending.popleft()
+                pending_bytes -= file_size
+                yield file_path, archive_file_path, future.result() if future else None
+        while pending:
+            file_path, archive_file_path, future, _ = pending.popleft()
+            yield file_path, archive_file_path, future.result() if future else None
+
+@contextmanager
+def _isal_deflate():
+    """
+    Temporarily routes zipfile's Deflate compression through ISA-L.
+
+    ISA-L (Intel's Storage Acceleration Library) produces the same DEFLATE
+    bitstream as zlib using SIMD-optimised routines, so the archive stays fully
+    compatible while compressing noticeably faster. ISA-L only supports levels
+    0-3; higher levels are clamped to 3.
+    """
+    original_get_compressor = zipfile._get_compressor
+
+    def _get_compressor(compress_type, compresslevel=None):
+        if compress_type == zipfile.ZIP_DEFLATED:
+            if compresslevel is None:
+                level = isal_zlib.ISAL_DEFAULT_COMPRESSION
+            else:
+                level = min(compresslevel, isal_zlib.ISAL_BEST_COMPRESSION)
+            return isal_zlib.compressobj(level, isal_zlib.DEFLATED, -15)
+        return original_get_compressor(compress_type, compresslevel)
+
+    zipfile._get_compressor = _get_compressor
+    try:
+        yield
+    finally:
+        zipfile._get_compressor = original_get_compressor
+
+def archive_datasets(source_dir: str, output_dir: str, compression_level: int = 1, no_compression: bool = False, fast_deflate: bool = False):
     """
     Creates a timestamped zip archive of a directory.
 
@@ -19,6 +157,13 @@ def archive_datasets(source_dir: str, output_dir: str):
     Args:
         source_dir (str): The directory to be archived (e.g., 'data/generated_datasets').
         output_dir (str): The directory where the zip archive will be saved.
+        compression_level (int): The Deflate level, 0 (fastest) to 9 (smallest).
+                                 These archives are usually short-lived backups,
+                                 so speed is favoured over size by default.
+        no_compression (bool): Store files without compressing them at all. Useful
+                               when the target filesystem compresses transparently.
+        fast_deflate (bool): Compress with ISA-L instead of zlib. Requires the
+                             optional 'isal' package.
     """
     if not os.path.isdir(source_dir):
         logging.error(f"Source directory not found: {source_dir}. Aborting archive.")
@@ -35,14 +180,40 @@ def archive_datasets(source_dir: str, output_dir: str):
     logging.info(f"Archiving directory '{source_dir}' to '{archive_path}'...")
 
     try:
-        with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            # Walk through the source directory
-            for root, _, files in os.walk(source_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    # Create a relative path for the files inside the zip
-                    archive_file_path = os.path.relpath(file_path, source_dir)
+        if no_compression:
+            zip_options = {"compression": zipfile.ZIP_STORED}
+        else:
+            zip_options = {"compression": zipfile.ZIP_DEFLATED, "compresslevel": compression_level}
+
+        use_isal = fast_deflate and not no_compression
+        if use_isal and isal_zlib is None:
+            logging.warning("The 'isal' package is not installed; falling back to zlib for compression.")
+            use_isal = False
+
+        # Collect every file up front, with a relative path for the files inside the zip.
+        file_pairs = []
+        for root, _, files in os.walk(source_dir):
+            for file in files:
+                file_path = os.path.join(root, file)
+                file_pairs.append((file_path, os.path.relpath(file_path, source_dir)))
+
+        with _isal_deflate() if use_isal else nullcontext(), zipfile.ZipFile(archive_path, 'w', **zip_options) as zipf:
+            if no_compression:
+                # Storing files is bound by disk I/O, so there is nothing to parallelize.
+                for file_path, archive_file_path in file_pairs:
                     zipf.write(file_path, archive_file_path)
+            else:
+                # Small files are deflated on worker threads while the writer adds
+                # finished entries; large ones are streamed in by zipf.write().
+                if use_isal:
+                    compressobj = partial(isal_zlib.compressobj, min(compression_level, isal_zlib.ISAL_BEST_COMPRESSION), isal_zlib.DEFLATED, -15)
+                else:
+                    compressobj = partial(zlib.compressobj, compression_level, zlib.DEFLATED, -15)
+                for file_path, archive_file_path, compressed in _iter_compressed_files(file_pairs, compressobj, max_workers=os.cpu_count() or 1):
+                    if compressed is None:
+                        zipf.write(file_path, archive_file_path)
+                    else:
+                        _write_precompressed(zipf, *compressed)
         
         logging.info("Archive created successfully!")
     except Exception as e:
@@ -53,9 +224,12 @@ def main():
     parser = argparse.ArgumentParser(description="Archive the generated datasets.")
     parser.add_argument("--source_dir", type=str, default="data/generated_datasets", help="Directory containing the datasets to archive.")
     parser.add_argument("--output_dir", type=str, default="data/archives", help="Directory to save the timestamped archive.")
+    parser.add_argument("--compression_level", type=int, default=1, choices=range(0, 10), metavar="{0-9}", help="Deflate compression level (1 = fastest, 9 = smallest).")
+    parser.add_argument("--no_compression", action="store_true", help="Store files uncompressed for maximum archiving speed.")
+    parser.add_argument("--fast_deflate", action="store_true", help="Compress with ISA-L instead of zlib (requires the 'isal' package).")
     args = parser.parse_args()
 
-    archive_datasets(args.source_dir, args.output_dir)
+    archive_datasets(args.source_dir, args.output_dir, args.compression_level, args.no_compression, args.fast_deflate)
 
 if __name__ == "__main__":
     main()
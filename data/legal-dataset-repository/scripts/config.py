@@ -43,7 +43,32 @@ CLASSIFICATION_LABELS = {
 
 # --- API & Model Configuration ---
 # You could centralize model names or API parameters here as well.
-# For example:
-# GENERATIVE_MODEL_NAME = 'gemini-1.5-flash'
+# 'gemini-1.5-flash' is a good balance of speed and capability.
+GENERATIVE_MODEL_NAME = 'gemini-1.5-flash'
 # MAX_TOKENS_OUTPUT = 1024
 
+# The Gemini REST API is called directly over a single, persistent HTTP/2 client.
+GEMINI_API_BASE_URL = 'https://generativelanguage.googleapis.com'
+REQUEST_TIMEOUT_SECONDS = 60
+
+# Successful API responses are cached on disk, keyed by model and request, so
+# re-running a pipeline over the same text doesn't pay for the same calls again.
+# Pass --no_cache to a generator script to force fresh responses.
+GEMINI_CACHE_DIR = '.gemini_cache'
+GEMINI_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+
+# --- Request Concurrency ---
+# The generator scripts are bound by API latency, not CPU, so chunks are sent
+# concurrently. These limits keep us under the provider's rate limits.
+MAX_CONCURRENT_REQUESTS = 16
+MAX_REQUESTS_PER_SECOND = 5
+
+# --- Output Writing ---
+# Generated records are encoded and written in batches through a large buffer,
+# so output costs a handful of syscalls rather than one per record.
+OUTPUT_BUFFER_SIZE = 1 << 20
+WRITE_BATCH_SIZE = 256
+
+# Output files ending in '.zst' are Zstandard-compressed. Level 3 shrinks JSONL
+# several-fold while staying far faster than the API can produce records.
+ZSTD_COMPRESSION_LEVEL = 3
@@ -1,71 +1,327 @@
 # scripts/evaluate_dataset.py
 
+import io
+import os
 import json
+import mmap
 import argparse
 import logging
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+import simdjson
+import zstandard
 
 # --- Configuration ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def evaluate_jsonl_dataset(file_path: str):
+# Empty values are collected during the scan and reported afterwards; only this
+# many are logged individually so a badly broken dataset doesn't flood the log.
+MAX_LOGGED_EMPTY_VALUES = 20
+
+# Uncompressed datasets at least this large are validated by several worker
+# processes, each taking a newline-aligned byte range of the file. Smaller files
+# aren't worth the cost of starting the workers.
+PARALLEL_MIN_FILE_SIZE = 8 << 20
+
+class _ValidationResult(NamedTuple):
+    """Problems found in a run of lines. Line numbers are relative to the first line of the run."""
+    line_count: int
+    invalid_json: list[tuple[int, str]]
+    mismatched_keys: list[tuple[int, list[str]]]
+    # Only the first MAX_LOGGED_EMPTY_VALUES are kept, since only those are logged.
+    empty_values: list[tuple[int, str]]
+    empty_value_count: int
+
+def _scan_record_structure(file_path: str) -> list[int]:
+    """
+    Runs a byte-level scan for structurally broken records.
+
+    The file is memory-mapped and each line is only checked to start with '{'
+    and end with '}', without decoding or parsing anything. This finds empty
+    lines and truncated records (e.g. from an interrupted write) without
+    paying for full JSON parsing, so a broken file can be rejected early.
+    The full validation pass finds the same records, so this is only worth
+    running when that pass would be skipped.
+
+    Args:
+        file_path (str): The path to a non-empty .jsonl dataset file.
+
+    Returns:
+        list[int]: The line numbers of malformed records.
+    """
+    malformed_lines = []
+    line_num = 0
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        size = len(mm)
+        start = 0
+        while start < size:
+            line_num += 1
+            end = mm.find(b'\n', start)
+            if end == -1:
+                end = size
+            # Ignore surrounding whitespace, such as the '\r' of Windows line endings.
+            first, last = start, end - 1
+            while first <= last and mm[first] in b' \t\r':
+                first += 1
+            while last >= first and mm[last] in b' \t\r':
+                last -= 1
+            if first > last or mm[first] != ord('{') or mm[last] != ord('}'):
+                malformed_lines.append(line_num)
+            start = end + 1
+    return malformed_lines
+
+def _ends_with_newline(file_path: str) -> bool:
+    """Returns whether a non-empty file ends with a newline, reading only its last byte."""
+    with open(file_path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+def _open_records(file_path: str):
+    """Opens a dataset for reading lines as bytes, decompressing '.zst' files on the fly."""
+    if file_path.endswith('.zst'):
+        reader = zstandard.ZstdDecompressor().stream_reader(open(file_path, 'rb'), read_across_frames=True)
+        return io.BufferedReader(reader)
+    return open(file_path, 'rb')
+
+def _parse_record(parser: simdjson.Parser, line: bytes):
+    """
+    Parses one record, falling back to the json module for valid JSON that
+    simdjson can't represent, such as integers beyond 64 bits or very deep nesting.
+
+    Raises:
+        ValueError: If the line is not valid JSON.
+    """
+    try:
+        return parser.parse(line)
+    except RuntimeError:
+        try:
+            return json.loads(line)
+        except RecursionError as e:
+            raise ValueError("document is nested too deeply") from e
+
+def _infer_expected_keys(file_path: str) -> frozenset | None:
+    """Returns the keys of the first valid JSON object in the dataset, or None if there is none."""
+    parser = simdjson.Parser()
+    with _open_records(file_path) as f:
+        for line in f:
+            try:
+                data = _parse_record(parser, line)
+            except ValueError:
+                continue
+            try:
+                if isinstance(data, (simdjson.Object, dict)):
+                    return frozenset(data.keys())
+            finally:
+                # The parser can't be reused while a document from it is still referenced.
+                del data
+    return None
+
+def _validate_lines(lines: Iterable[bytes], expected_keys: frozenset | None) -> _ValidationResult:
+    """
+    Parses each line and checks it against the expected keys.
+
+    Args:
+        lines (Iterable[bytes]): The raw lines to validate.
+        expected_keys (frozenset | None): The keys every record must have.
+
+    Returns:
+        _ValidationResult: Everything wrong with the lines, for the caller to report.
+    """
+    invalid_json = []
+    mismatched_keys = []
+    empty_values = []
+    empty_value_count = 0
+    expected_len = len(expected_keys) if expected_keys is not None else 0
+    line_count = 0
+
+    # A single simdjson parser is reused for every record, and its documents
+    # are read lazily rather than converted into Python dicts.
+    parser = simdjson.Parser()
+    for line_num, line in enumerate(lines, start=1):
+        line_count = line_num
+        try:
+            data = _parse_record(parser, line)
+        except ValueError as e:
+            invalid_json.append((line_num, str(e)))
+            continue
+
+        try:
+            if not isinstance(data, (simdjson.Object, dict)):
+                invalid_json.append((line_num, "not a JSON object"))
+                continue
+
+            # Check for missing keys and empty values in a single pass. A record
+            # with the right number of keys that are all expected has exactly
+            # the expected keys, unless one of them is repeated: simdjson keeps
+            # duplicate fields, so the distinct keys are counted as well.
+            keys_match = len(data) == expected_len
+            empty_keys = []
+            if keys_match:
+                seen_keys = set()
+                for key, value in data.items():
+                    if key not in expected_keys or key in seen_keys:
+                        keys_match = False
+                        break
+                    seen_keys.add(key)
+                    if not value and value != 0: # Allow 0 as a valid value
+                        empty_keys.append(key)
+
+            if not keys_match:
+                mismatched_keys.append((line_num, sorted(set(data.keys()))))
+                continue
+
+            empty_value_count += len(empty_keys)
+            for key in empty_keys[:MAX_LOGGED_EMPTY_VALUES - len(empty_values)]:
+                empty_values.append((line_num, key))
+        finally:
+            # The parser can't be reused while a document from it is still referenced.
+            del data
+
+    return _ValidationResult(line_count, invalid_json, mismatched_keys, empty_values, empty_value_count)
+
+def _iter_range_lines(f, start: int, end: int) -> Iterator[bytes]:
+    """Yields the lines of a binary file that begin within the byte range [start, end)."""
+    f.seek(start)
+    position = start
+    while position < end:
+        line = f.readline()
+        if not line:
+            break
+        position += len(line)
+        yield line
+
+def _validate_range(file_path: str, start: int, end: int, expected_keys: frozenset | None) -> _ValidationResult:
+    """Validates the lines in one byte range of a dataset. Runs in a worker process."""
+    with open(file_path, 'rb') as f:
+        return _validate_lines(_iter_range_lines(f, start, end), expected_keys)
+
+def _split_into_line_ranges(file_path: str, parts: int) -> list[tuple[int, int]]:
     """
-    Performs basic quality checks on a JSON Lines (.jsonl) dataset file.
+    Splits a file into roughly equal byte ranges that each start at a line boundary.
+
+    Args:
+        file_path (str): The path to a non-empty file.
+        parts (int): The desired number of ranges.
+
+    Returns:
+        list[tuple[int, int]]: (start, end) byte offsets, covering the whole file in order.
+    """
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        size = len(mm)
+        cuts = [0]
+        for i in range(1, parts):
+            # Snap each cut to just after the next newline.
+            newline = mm.find(b'\n', max(size * i // parts, cuts[-1]))
+            if newline == -1:
+                break
+            if newline + 1 > cuts[-1]:
+                cuts.append(newline + 1)
+    cuts.append(size)
+    return [(start, end) for start, end in zip(cuts, cuts[1:]) if start < end]
+
+def evaluate_jsonl_dataset(file_path: str, fail_fast: bool = False, workers: int | None = None):
+    """
+    Performs basic quality checks on a JSON Lines (.jsonl or .jsonl.zst) dataset file.
 
     This script is a crucial part of a production pipeline, ensuring that
     downstream tasks receive clean, valid data.
 
     Checks performed:
-    1.  Each line is a valid JSON object.
-    2.  Each JSON object contains all expected keys.
-    3.  The values for those keys are not empty or null.
+    1.  Each line looks like a complete JSON object (a byte-level pre-scan,
+        only run with fail_fast).
+    2.  Each line is a valid JSON object.
+    3.  Each JSON object contains all expected keys.
+    4.  The values for those keys are not empty or null.
 
     Args:
         file_path (str): The path to the .jsonl dataset file.
+        fail_fast (bool): Pre-scan the file for empty or truncated records and
+                          stop if there are any, without fully parsing it.
+        workers (int | None): The number of processes used to validate large,
+                              uncompressed files. Defaults to the CPU count.
     """
     logging.info(f"Starting evaluation for dataset: {file_path}")
     
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
+        file_size = os.path.getsize(file_path)
     except FileNotFoundError:
         logging.error(f"Evaluation failed: File not found at {file_path}")
         return
 
-    if not lines:
+    if file_size == 0:
         logging.warning("The dataset file is empty.")
         return
 
-    total_lines = len(lines)
-    invalid_json_count = 0
-    missing_key_count = 0
-    empty_value_count = 0
-    
+    if not file_path.endswith('.zst') and not _ends_with_newline(file_path):
+        logging.warning("The dataset file does not end with a newline; the last record may be truncated.")
+
+    # Pass 1 (fail_fast only): structural scan, so a broken file is rejected
+    # without being fully parsed. Every clean file would pay for it otherwise,
+    # since pass 2 finds the same records. It needs the raw bytes on disk, so
+    # it is skipped for compressed datasets.
+    if fail_fast:
+        if file_path.endswith('.zst'):
+            logging.info("Skipping the structural pre-scan for a compressed dataset.")
+        else:
+            malformed_lines = _scan_record_structure(file_path)
+            if malformed_lines:
+                logging.error(f"Pre-scan found {len(malformed_lines)} empty or truncated record(s), first at line {malformed_lines[0]}.")
+                logging.error("Result: Dataset has malformed records. Skipping full validation.")
+                return
+
     # Determine expected keys from the first valid line
-    expected_keys = None
+    expected_keys = _infer_expected_keys(file_path)
+    if expected_keys is not None:
+        logging.info(f"Inferred expected keys from first record: {sorted(expected_keys)}")
 
-    for i, line in enumerate(lines):
-        line_num = i + 1
-        try:
-            data = json.loads(line)
-            if expected_keys is None:
-                expected_keys = set(data.keys())
-                logging.info(f"Inferred expected keys from first record: {sorted(list(expected_keys))}")
-
-            # Check for missing keys
-            if set(data.keys()) != expected_keys:
-                missing_key_count += 1
-                logging.warning(f"Line {line_num}: Mismatched keys. Expected {expected_keys}, got {set(data.keys())}")
-                continue
-            
-            # Check for empty values
-            for key, value in data.items():
-                if not value and value != 0: # Allow 0 as a valid value
-                    empty_value_count += 1
-                    logging.warning(f"Line {line_num}: Empty value for key '{key}'")
+    # Pass 2: full parse and schema checks. JSONL splits cleanly at newlines, so
+    # large uncompressed files are cut into line-aligned byte ranges that are
+    # validated in parallel. Otherwise the file is streamed line by line, so
+    # memory use stays flat no matter how large the dataset is.
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and file_size >= PARALLEL_MIN_FILE_SIZE and not file_path.endswith('.zst'):
+        ranges = _split_into_line_ranges(file_path, workers)
+        with ProcessPoolExecutor(max_workers=len(ranges)) as executor:
+            results = list(executor.map(
+                _validate_range,
+                [file_path] * len(ranges),
+                [start for start, _ in ranges],
+                [end for _, end in ranges],
+                [expected_keys] * len(ranges),
+            ))
+    else:
+        with _open_records(file_path) as f:
+            results = [_validate_lines(f, expected_keys)]
+
+    # Merge the per-range results, converting to file-wide line numbers.
+    total_lines = 0
+    invalid_json = []
+    mismatched_keys = []
+    empty_values = []
+    empty_value_count = 0
+    for result in results:
+        invalid_json.extend((total_lines + line_num, reason) for line_num, reason in result.invalid_json)
+        mismatched_keys.extend((total_lines + line_num, keys) for line_num, keys in result.mismatched_keys)
+        empty_values.extend((total_lines + line_num, key) for line_num, key in result.empty_values[:MAX_LOGGED_EMPTY_VALUES - len(empty_values)])
+        empty_value_count += result.empty_value_count
+        total_lines += result.line_count
+
+    for line_num, reason in invalid_json:
+        logging.error(f"Line {line_num}: Invalid JSON format ({reason}).")
+    for line_num, keys in mismatched_keys:
+        logging.warning(f"Line {line_num}: Mismatched keys. Expected {sorted(expected_keys)}, got {keys}")
+    invalid_json_count = len(invalid_json)
+    missing_key_count = len(mismatched_keys)
+
+    if total_lines == 0:
+        logging.warning("The dataset file is empty.")
+        return
 
-        except json.JSONDecodeError:
-            invalid_json_count += 1
-            logging.error(f"Line {line_num}: Invalid JSON format.")
+    for line_num, key in empty_values:
+        logging.warning(f"Line {line_num}: Empty value for key '{key}'")
+    if empty_value_count > MAX_LOGGED_EMPTY_VALUES:
+        logging.warning(f"... and {empty_value_count - MAX_LOGGED_EMPTY_VALUES} more empty value(s) not shown.")
 
     logging.info("--- Evaluation Summary ---")
     logging.info(f"Total records processed: {total_lines}")
@@ -82,10 +338,12 @@ def evaluate_jsonl_dataset(file_path: str):
 def main():
     """Main function to run the evaluation script."""
     parser = argparse.ArgumentParser(description="Evaluate a generated .jsonl dataset for quality.")
-    parser.add_argument("--input_file", type=str, required=True, help="Path to the .jsonl dataset to evaluate.")
+    parser.add_argument("--input_file", type=str, required=True, help="Path to the .jsonl (or .jsonl.zst) dataset to evaluate.")
+    parser.add_argument("--fail_fast", action="store_true", help="Run a quick structural pre-scan first and stop if it finds empty or truncated records.")
+    parser.add_argument("--workers", type=int, default=None, help="Processes used to validate large files (default: number of CPUs).")
     args = parser.parse_args()
     
-    evaluate_jsonl_dataset(args.input_file)
+    evaluate_jsonl_dataset(args.input_file, args.fail_fast, args.workers)
 
 if __name__ == "__main__":
     main()
@@ -1,54 +1,57 @@
 # scripts/generate_classifications.py
 
 import os
-import json
+import hashlib
 import argparse
 import asyncio
 import logging
-from tqdm import tqdm
+from functools import partial
+import diskcache
+import httpx
 from dotenv import load_dotenv
-import google.generativeai as genai
 
 # Import shared utilities and the new config file
-from .utils import split_text_into_chunks, read_text_file
+from .utils import TextChunks, generate_json_content, read_text_file, run_generation
 from .config import CLASSIFICATION_LABELS
 
 # --- Configuration ---
 load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-async def generate_classification_from_text(text_chunk: str, domain: str):
-    """
-    Classifies a text chunk into a predefined category for a given domain.
-
-    Args:
-        text_chunk (str): The source text to classify.
-        domain (str): The domain used to fetch the appropriate classification labels.
-
-    Returns:
-        A dictionary with the text and its classification, or None on failure.
-    """
-    api_key = os.getenv("GOOGLE_API_KEY")
-    if not api_key:
-        logging.error("FATAL: GOOGLE_API_KEY not set.")
-        return None
-
-    genai.configure(api_key=api_key)
-    
-    # Fetch the classification labels for the specified domain from our config.
-    labels = CLASSIFICATION_LABELS.get(domain, CLASSIFICATION_LABELS["default"])
-    
-    # Define the JSON schema, dynamically inserting the valid labels.
-    schema = {
-        "type": "OBJECT",
-        "properties": {
-            "text_snippet": {"type": "STRING"},
-            "classification": {"type": "STRING", "enum": labels}
-        },
-        "required": ["text_snippet", "classification"]
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+if not GOOGLE_API_KEY:
+    raise RuntimeError("FATAL: GOOGLE_API_KEY not set.")
+
+# Classifications requested during this run, keyed on a digest of the domain and
+# the chunk. Boilerplate clauses often recur verbatim throughout a document, so
+# repeats share the first request instead of making an API call. The key is the
+# exact chunk, not a normalized form, because the model echoes the chunk back as
+# the record's text_snippet.
+_cls_cache: dict[bytes, asyncio.Future] = {}
+
+def _classification_cache_key(text_chunk: str, domain: str) -> bytes:
+    """Returns a fixed-size cache key for a chunk."""
+    return hashlib.blake2b(f"{domain}\0{text_chunk}".encode('utf-8'), digest_size=16).digest()
+
+# The labels, schema and prompt text around the chunk only depend on the domain,
+# so they are built once per domain here rather than once per chunk. The JSON
+# schema dynamically inserts each domain's valid labels.
+_GENERATION_CONFIG = {
+    domain: {
+        "responseMimeType": "application/json",
+        "responseSchema": {
+            "type": "OBJECT",
+            "properties": {
+                "text_snippet": {"type": "STRING"},
+                "classification": {"type": "STRING", "enum": labels}
+            },
+            "required": ["text_snippet", "classification"]
+        }
     }
-
-    prompt = f"""
+    for domain, labels in CLASSIFICATION_LABELS.items()
+}
+_PROMPT_PREFIX = {
+    domain: f"""
     You are a text classification expert. Your task is to classify the following text snippet into one of the provided categories.
     Choose the single best category from the list.
 
@@ -56,29 +59,64 @@ async def generate_classification_from_text(text_chunk: str, domain: str):
 
     Text to Classify:
     ---
-    {text_chunk}
+    """
+    for domain, labels in CLASSIFICATION_LABELS.items()
+}
+_PROMPT_SUFFIX = """
     ---
     """
+
+async def generate_classification_from_text(text_chunk: str, domain: str, client: httpx.AsyncClient, cache: diskcache.Cache | None = None):
+    """
+    Classifies a text chunk into a predefined category for a given domain.
+
+    Args:
+        text_chunk (str): The source text to classify.
+        domain (str): The domain used to fetch the appropriate classification labels.
+        client (httpx.AsyncClient): The shared API client for this run.
+        cache (diskcache.Cache | None): The on-disk response cache, if enabled.
+
+    Returns:
+        A dictionary with the text and its classification, or None on failure.
+    """
+    # Repeats wait on the first request for the same chunk, even while it is
+    # still in flight, so they never reach the API or its rate limit.
+    cache_key = _classification_cache_key(text_chunk, domain)
+    cached = _cls_cache.get(cache_key)
+    if cached is not None:
+        return await cached
+    future = asyncio.get_running_loop().create_future()
+    _cls_cache[cache_key] = future
+
+    # Fetch the prompt and schema for the specified domain.
+    if domain not in _PROMPT_PREFIX:
+        domain = "default"
+    prompt = _PROMPT_PREFIX[domain] + text_chunk + _PROMPT_SUFFIX
     
     payload = {
         "contents": [{"role": "user", "parts": [{"text": prompt}]}],
-        "generation_config": {"response_mime_type": "application/json", "response_schema": schema}
+        "generationConfig": _GENERATION_CONFIG[domain]
     }
 
+    classification = None
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        response = await model.generate_content_async(payload['contents'], generation_config=payload['generation_config'])
-        return json.loads(response.text)
+        classification = await generate_json_content(client, payload, cache=cache)
     except Exception as e:
         logging.error(f"API call for classification failed: {e}")
-        return None
-
-def main():
-    """Main function to orchestrate the classification dataset generation."""
+    finally:
+        # Failures are not remembered, so a later repeat of the chunk can retry.
+        if classification is None:
+            del _cls_cache[cache_key]
+        future.set_result(classification)
+    return classification
+
+async def main_async():
+    """Main coroutine to orchestrate the classification dataset generation."""
     parser = argparse.ArgumentParser(description="Generate a synthetic classification dataset.")
     parser.add_argument("--input_file", type=str, required=True, help="Path to the source .txt file.")
-    parser.add_argument("--output_file", type=str, required=True, help="Path for the output .jsonl file.")
+    parser.add_argument("--output_file", type=str, required=True, help="Path for the output .jsonl file (use .jsonl.zst for Zstandard-compressed output).")
     parser.add_argument("--domain", type=str, required=True, choices=list(CLASSIFICATION_LABELS.keys()), help="Domain to use for classification labels.")
+    parser.add_argument("--no_cache", action="store_true", help="Ignore cached API responses and always call the API.")
     args = parser.parse_args()
 
     logging.info(f"Starting classification for domain: '{args.domain}'")
@@ -88,23 +126,27 @@ def main():
         return
 
     # For classification, we want to classify smaller, more focused chunks.
-    text_chunks = split_text_into_chunks(source_text, max_chunk_size=500, overlap=50)
+    text_chunks = TextChunks(source_text, max_chunk_size=500, overlap=50)
     if not text_chunks:
         return
 
     os.makedirs(os.path.dirname(args.output_file), exist_ok=True)
-    total_classifications = 0
-    
-    with open(args.output_file, 'w', encoding='utf-8') as f:
-        for chunk in tqdm(text_chunks, desc="Classifying text snippets"):
-            classification_data = asyncio.run(generate_classification_from_text(chunk, args.domain))
-            if classification_data:
-                f.write(json.dumps(classification_data) + '\n')
-                total_classifications += 1
+    total_classifications = await run_generation(
+        text_chunks,
+        partial(generate_classification_from_text, domain=args.domain),
+        args.output_file,
+        GOOGLE_API_KEY,
+        use_cache=not args.no_cache,
+        desc="Classifying text snippets",
+    )
 
     logging.info(f"--- Classification Complete ---")
     logging.info(f"Generated {total_classifications} classifications.")
     logging.info(f"Output saved to: {args.output_file}")
 
+def main():
+    """Synchronous entry point: runs main_async() on a single event loop."""
+    asyncio.run(main_async())
+
 if __name__ == "__main__":
     main()
@@ -1,17 +1,17 @@
 # scripts/generate_qa_dataset.py
 
 import os
-import json
 import argparse
 import asyncio
 import logging
-from tqdm import tqdm
+from functools import partial
+import diskcache
+import httpx
 from dotenv import load_dotenv
-import google.generativeai as genai
 
 # Import helper functions from our utility module within the same package.
 # The '.' before 'utils' indicates a relative import from the same package.
-from .utils import split_text_into_chunks, read_text_file
+from .utils import TextChunks, generate_json_content, read_text_file, run_generation
 
 # --- Configuration ---
 
@@ -22,6 +22,11 @@ load_dotenv()
 # Configure logging to provide clear, timestamped output.
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Read the API key once, at import time, rather than on every request.
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+if not GOOGLE_API_KEY:
+    raise RuntimeError("FATAL: GOOGLE_API_KEY environment variable not set. Please create a .env file or set it manually.")
+
 # --- Domain-Specific Prompt Engineering ---
 
 # This dictionary holds prompt "personas" for different domains.
@@ -34,7 +39,46 @@ PROMPT_TEMPLATES = {
     "default": "You are a helpful AI assistant. Your task is to create structured training data from the provided text."
 }
 
-async def generate_qa_from_text(text_chunk: str, domain: str):
+# Define the JSON schema for the model's output. This is a powerful feature
+# that forces the model to return clean, predictable JSON, which is ideal for
+# production pipelines.
+QA_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "question": {"type": "STRING", "description": "A detailed question derived from the text."},
+            "answer": {"type": "STRING", "description": "A precise answer to the question."},
+            "context_used": {"type": "STRING", "description": "The exact text snippet used for the answer."}
+        },
+        "required": ["question", "answer", "context_used"]
+    }
+}
+
+# Everything except the chunk itself is identical from request to request, so the
+# generation config and the prompt text surrounding the chunk are built once per
+# domain here rather than once per chunk.
+_GENERATION_CONFIG = {
+    "responseMimeType": "application/json",
+    "responseSchema": QA_SCHEMA
+}
+_PROMPT_PREFIX = {
+    domain: f"""
+    {persona}
+    Based on the following text, generate a series of high-quality question-and-answer pairs.
+    Each pair must be directly and fully answerable from the provided text.
+    The answer should be thorough and precise. Also include the specific context snippet used for the answer.
+
+    Text:
+    ---
+    """
+    for domain, persona in PROMPT_TEMPLATES.items()
+}
+_PROMPT_SUFFIX = """
+    ---
+    """
+
+async def generate_qa_from_text(text_chunk: str, domain: str, client: httpx.AsyncClient, cache: diskcache.Cache | None = None):
     """
     Generates structured question-answer pairs from a chunk of text using the Gemini API.
 
@@ -45,82 +89,44 @@ async def generate_qa_from_text(text_chunk: str, domain: str):
         text_chunk (str): A string containing the source text for generation.
         domain (str): The domain of the text (e.g., 'legal', 'finance'), which
                       determines the prompt persona.
+        client (httpx.AsyncClient): The shared API client for this run.
+        cache (diskcache.Cache | None): The on-disk response cache, if enabled.
 
     Returns:
         A list of dictionaries, where each dictionary is a Q&A pair. Returns an
         empty list if the API call fails or returns an invalid structure.
     """
-    api_key = os.getenv("GOOGLE_API_KEY")
-    if not api_key:
-        logging.error("FATAL: GOOGLE_API_KEY environment variable not set. Please create a .env file or set it manually.")
-        return []
-
-    genai.configure(api_key=api_key)
-    
-    # Define the JSON schema for the model's output. This is a powerful feature
-    # that forces the model to return clean, predictable JSON, which is ideal for
-    # production pipelines.
-    schema = {
-        "type": "ARRAY",
-        "items": {
-            "type": "OBJECT",
-            "properties": {
-                "question": {"type": "STRING", "description": "A detailed question derived from the text."},
-                "answer": {"type": "STRING", "description": "A precise answer to the question."},
-                "context_used": {"type": "STRING", "description": "The exact text snippet used for the answer."}
-            },
-            "required": ["question", "answer", "context_used"]
-        }
-    }
-
-    # Select the appropriate persona from our templates based on the domain.
-    persona = PROMPT_TEMPLATES.get(domain, PROMPT_TEMPLATES["default"])
-    
-    # Construct the final prompt sent to the model.
-    prompt = f"""
-    {persona}
-    Based on the following text, generate a series of high-quality question-and-answer pairs.
-    Each pair must be directly and fully answerable from the provided text.
-    The answer should be thorough and precise. Also include the specific context snippet used for the answer.
-
-    Text:
-    ---
-    {text_chunk}
-    ---
-    """
+    # Select the appropriate persona from our templates based on the domain,
+    # and construct the final prompt sent to the model.
+    prompt_prefix = _PROMPT_PREFIX.get(domain, _PROMPT_PREFIX["default"])
+    prompt = prompt_prefix + text_chunk + _PROMPT_SUFFIX
     
     # Prepare the payload for the API call.
     payload = {
         "contents": [{"role": "user", "parts": [{"text": prompt}]}],
-        "generation_config": {
-            "response_mime_type": "application/json",
-            "response_schema": schema
-        }
+        "generationConfig": _GENERATION_CONFIG
     }
 
     try:
-        # Initialize the model. 'gemini-1.5-flash' is a good balance of speed and capability.
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        # Make the asynchronous API call.
-        response = await model.generate_content_async(payload['contents'], generation_config=payload['generation_config'])
-        
-        # The response.text will be a JSON string that matches our schema.
-        return json.loads(response.text)
+        # Make the asynchronous API call. The reply is JSON that matches our schema.
+        return await generate_json_content(client, payload, cache=cache)
         
     except Exception as e:
         logging.error(f"An error occurred during the API call: {e}")
         return []
 
-def main():
+async def main_async():
     """
-    The main function that orchestrates the entire dataset generation process.
-    It handles command-line arguments, file I/O, and calls the generation function.
+    The main coroutine that orchestrates the entire dataset generation process.
+    It handles command-line arguments, file I/O, and awaits the generation of
+    every chunk, so the whole run shares one event loop.
     """
     # Set up command-line argument parsing for a professional user experience.
     parser = argparse.ArgumentParser(description="Generate a synthetic Question/Answer dataset from a text file.")
     parser.add_argument("--input_file", type=str, required=True, help="Path to the source .txt file.")
-    parser.add_argument("--output_file", type=str, required=True, help="Path for the output .jsonl file.")
+    parser.add_argument("--output_file", type=str, required=True, help="Path for the output .jsonl file (use .jsonl.zst for Zstandard-compressed output).")
     parser.add_argument("--domain", type=str, default="default", choices=list(PROMPT_TEMPLATES.keys()), help="Domain of the source text to tailor the prompt.")
+    parser.add_argument("--no_cache", action="store_true", help="Ignore cached API responses and always call the API.")
     args = parser.parse_args()
 
     logging.info(f"Starting dataset generation process for domain: '{args.domain}'")
@@ -132,32 +138,34 @@ def main():
         return
 
     # Step 2: Split the source text into manageable chunks for API processing.
-    text_chunks = split_text_into_chunks(source_text)
+    text_chunks = TextChunks(source_text)
     if not text_chunks:
         logging.warning("Source text was empty or could not be split into chunks. No data to process.")
         return
 
     # Step 3: Ensure the output directory exists before trying to write to it.
     os.makedirs(os.path.dirname(args.output_file), exist_ok=True)
-    total_pairs_generated = 0
     
-    # Step 4: Process each chunk and write the results to the output file.
-    # The 'with' statement ensures the file is properly closed even if errors occur.
-    with open(args.output_file, 'w', encoding='utf-8') as f:
-        # tqdm provides a progress bar for a better user experience with large files.
-        for chunk in tqdm(text_chunks, desc="Processing text chunks"):
-            # Run our asynchronous generation function for the current chunk.
-            qa_pairs = asyncio.run(generate_qa_from_text(chunk, args.domain))
-            if qa_pairs:
-                for pair in qa_pairs:
-                    # Write each generated Q&A pair as a new line in the JSONL file.
-                    f.write(json.dumps(pair) + '\n')
-                total_pairs_generated += len(qa_pairs)
+    # Step 4: Process all chunks concurrently on a single event loop and write
+    # the results to the output file.
+    total_pairs_generated = await run_generation(
+        text_chunks,
+        partial(generate_qa_from_text, domain=args.domain),
+        args.output_file,
+        GOOGLE_API_KEY,
+        use_cache=not args.no_cache,
+        desc="Processing text chunks",
+        to_records=lambda qa_pairs: qa_pairs or (),
+    )
 
     logging.info(f"--- Generation Complete ---")
     logging.info(f"Successfully generated {total_pairs_generated} Q&A pairs.")
     logging.info(f"Output dataset saved to: {args.output_file}")
 
+def main():
+    """Synchronous entry point: runs main_async() on a single event loop."""
+    asyncio.run(main_async())
+
 if __name__ == "__main__":
     # This standard Python construct ensures that main() is called only when the script
     # is executed directly, not when it's imported as a module elsewhere.
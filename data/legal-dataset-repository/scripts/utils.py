@@ -1,19 +1,41 @@
+import asyncio
+import hashlib
 import logging
 import os
+import time
+from collections.abc import AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, Iterator, Sequence
+from contextlib import nullcontext
+from typing import BinaryIO, TypeVar
+
+import aiometer
+import diskcache
+import httpx
+import orjson
+import zstandard
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+from tqdm.asyncio import tqdm
+
+from .config import GEMINI_API_BASE_URL, GEMINI_CACHE_DIR, GEMINI_CACHE_TTL_SECONDS, GENERATIVE_MODEL_NAME, MAX_CONCURRENT_REQUESTS, MAX_REQUESTS_PER_SECOND, OUTPUT_BUFFER_SIZE, REQUEST_TIMEOUT_SECONDS, WRITE_BATCH_SIZE, ZSTD_COMPRESSION_LEVEL
+
+T = TypeVar("T")
 
 # --- Configuration ---
 # Set up a basic logger to output informational messages and errors.
 # This is more robust than using print() statements for debugging.
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# httpx logs every request at INFO, which would flood the progress bar with
+# one line per chunk. Its warnings and errors still come through.
+logging.getLogger("httpx").setLevel(logging.WARNING)
 
-def split_text_into_chunks(text: str, max_chunk_size: int = 4000, overlap: int = 200) -> list[str]:
+def iter_text_chunks(text: str, max_chunk_size: int = 4000, overlap: int = 200) -> Iterator[str]:
     """
-    Splits a long text into smaller, overlapping chunks.
+    Lazily yields smaller, overlapping chunks of a long text.
 
     This function is critical for handling large documents that exceed the token limit
     of a single API call to a generative model. By creating overlapping chunks,
     we help preserve the context between them, which can lead to more coherent
-    and accurate generated data.
+    and accurate generated data. Chunks are sliced one at a time as the caller
+    consumes them, so a large document is never copied into memory all at once.
 
     Args:
         text (str): The full text document to be split.
@@ -22,25 +44,104 @@ def split_text_into_chunks(text: str, max_chunk_size: int = 4000, overlap: int =
         overlap (int): The number of characters to include from the end of the previous
                        chunk at the beginning of the next one.
 
+    Yields:
+        str: Each chunk of the original text, in order.
+    """
+    if not isinstance(text, str) or not text:
+        logging.warning("Input text is empty or not a string. No chunks to yield.")
+        return
+
+    # Move the start index forward for each chunk, accounting for the overlap.
+    for start_index in range(0, len(text), max_chunk_size - overlap):
+        yield text[start_index:start_index + max_chunk_size]
+
+def split_text_into_chunks(text: str, max_chunk_size: int = 4000, overlap: int = 200) -> list[str]:
+    """
+    Splits a long text into a list of smaller, overlapping chunks.
+
+    This is the eager form of iter_text_chunks(), kept for callers that need
+    every chunk up front.
+
+    Args:
+        text (str): The full text document to be split.
+        max_chunk_size (int): The maximum number of characters for each chunk.
+        overlap (int): The number of characters shared by consecutive chunks.
+
     Returns:
         list[str]: A list of text strings, each representing a chunk of the original text.
     """
-    if not isinstance(text, str) or not text:
-        logging.warning("Input text is empty or not a string. Returning empty list.")
-        return []
-
-    chunks = []
-    start_index = 0
-    # Loop through the text, creating chunks until the end is reached.
-    while start_index < len(text):
-        end_index = start_index + max_chunk_size
-        chunks.append(text[start_index:end_index])
-        # Move the start index forward for the next chunk, accounting for the overlap.
-        start_index += max_chunk_size - overlap
-    
-    logging.info(f"Successfully split source text into {len(chunks)} chunk(s).")
+    chunks = list(iter_text_chunks(text, max_chunk_size, overlap))
+    if chunks:
+        logging.info(f"Successfully split source text into {len(chunks)} chunk(s).")
     return chunks
 
+class TextChunks(Sequence[str]):
+    """
+    A lazy, read-only sequence of the overlapping chunks of a text.
+
+    Behaves like the list returned by split_text_into_chunks(), but each chunk
+    is only sliced out of the source text when it is accessed. This lets the
+    generator scripts hand the chunks to aiometer, which needs len(), without
+    materializing the whole document as a list of strings first.
+
+    Chunks are plain str slices rather than memoryview slices of an encoded
+    buffer: every chunk ends up inside a str prompt, so a view would only
+    defer the copy, not avoid it. Only the chunks currently being processed
+    are ever alive at once.
+
+    Args:
+        text (str): The full text document to be split.
+        max_chunk_size (int): The maximum number of characters for each chunk.
+        overlap (int): The number of characters shared by consecutive chunks.
+    """
+
+    def __init__(self, text: str, max_chunk_size: int = 4000, overlap: int = 200):
+        self._text = text if isinstance(text, str) else ""
+        self._max_chunk_size = max_chunk_size
+        self._overlap = overlap
+        # Number of chunk start offsets in range(0, len(text), step), i.e. ceil(len / step).
+        step = max_chunk_size - overlap
+        self._length = -(-len(self._text) // step)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("chunk index out of range")
+        start_index = index * (self._max_chunk_size - self._overlap)
+        return self._text[start_index:start_index + self._max_chunk_size]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter_text_chunks(self._text, self._max_chunk_size, self._overlap)
+
+async def in_chunk_order(results: AsyncIterable[tuple[int, T]]) -> AsyncIterator[T]:
+    """
+    Re-orders (chunk_index, result) pairs that arrive out of order.
+
+    Concurrent requests complete in whatever order the API answers them, so
+    results that arrive early are held back until every earlier chunk has been
+    yielded. This keeps the output in document order and reproducible.
+
+    Args:
+        results (AsyncIterable[tuple[int, T]]): Results tagged with their chunk index,
+                                                covering indices 0, 1, 2, ... exactly once.
+
+    Yields:
+        T: Each result, in chunk order.
+    """
+    pending: dict[int, T] = {}
+    next_index = 0
+    async for index, result in results:
+        pending[index] = result
+        while next_index in pending:
+            yield pending.pop(next_index)
+            next_index += 1
+
 def read_text_file(file_path: str) -> str | None:
     """
     Reads content from a specified text file with robust error handling.
@@ -67,3 +168,200 @@ def read_text_file(file_path: str) -> str | None:
         logging.error(f"An unexpected error occurred while reading the file {file_path}: {e}")
         return None
 
+def open_output_file(file_path: str) -> BinaryIO:
+    """
+    Opens a dataset file for buffered binary writing.
+
+    If the path ends in '.zst', the output is Zstandard-compressed on the fly
+    using all available cores, which makes the artifact several times smaller
+    and cheaper to read back downstream.
+
+    Args:
+        file_path (str): The path of the file to create.
+
+    Returns:
+        BinaryIO: A writable binary file object, to be used as a context manager.
+    """
+    if file_path.endswith('.zst'):
+        compressor = zstandard.ZstdCompressor(level=ZSTD_COMPRESSION_LEVEL, threads=-1)
+        return compressor.stream_writer(open(file_path, 'wb', buffering=OUTPUT_BUFFER_SIZE))
+    return open(file_path, 'wb', buffering=OUTPUT_BUFFER_SIZE)
+
+def create_gemini_client(api_key: str) -> httpx.AsyncClient:
+    """
+    Creates an HTTP/2 client for the Gemini REST API.
+
+    A single client should be shared by every request in a run. It keeps its
+    TCP/TLS connections alive and multiplexes concurrent requests over them,
+    instead of paying connection setup for each chunk. Use it as an async
+    context manager so the connections are closed when the run finishes.
+
+    Args:
+        api_key (str): The Google API key, sent in a header on every request.
+
+    Returns:
+        httpx.AsyncClient: The configured client.
+    """
+    return httpx.AsyncClient(
+        base_url=GEMINI_API_BASE_URL,
+        headers={"x-goog-api-key": api_key},
+        http2=True,
+        timeout=REQUEST_TIMEOUT_SECONDS,
+        limits=httpx.Limits(max_connections=MAX_CONCURRENT_REQUESTS, max_keepalive_connections=MAX_CONCURRENT_REQUESTS),
+    )
+
+def _is_rate_limited(exception: BaseException) -> bool:
+    """Returns True for HTTP 429 (Too Many Requests) responses."""
+    return isinstance(exception, httpx.HTTPStatusError) and exception.response.status_code == 429
+
+def open_response_cache(enabled: bool = True):
+    """
+    Opens the on-disk cache of API responses shared by the generator scripts.
+
+    Args:
+        enabled (bool): Whether to use the cache at all.
+
+    Returns:
+        A context manager yielding a diskcache.Cache, or None when disabled.
+    """
+    return diskcache.Cache(GEMINI_CACHE_DIR) if enabled else nullcontext()
+
+def _response_cache_key(model_name: str, payload: dict) -> str:
+    """Returns a digest identifying a request: the model plus the full payload (prompt and schema)."""
+    request = orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(model_name.encode('utf-8') + b'|' + request, digest_size=32).hexdigest()
+
+class _RateLimiter:
+    """Spaces out API requests so that at most `per_second` are started each second."""
+
+    def __init__(self, per_second: float):
+        self._interval = 1 / per_second
+        self._next_start = 0.0
+
+    async def wait(self) -> None:
+        now = time.monotonic()
+        start = max(now, self._next_start)
+        self._next_start = start + self._interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+# The rate limit applies to HTTP calls only, not to whole chunk tasks, so chunks
+# answered from a cache are written as fast as they can be looked up.
+_request_rate_limiter = _RateLimiter(MAX_REQUESTS_PER_SECOND)
+
+# Retry rate-limited requests with jittered exponential backoff, so a burst of
+# concurrent chunks doesn't turn into a burst of failed chunks.
+@retry(
+    retry=retry_if_exception(_is_rate_limited),
+    wait=wait_exponential_jitter(),
+    stop=stop_after_attempt(6),
+    reraise=True,
+)
+async def _post_generate_content(client: httpx.AsyncClient, payload: dict, model_name: str):
+    """Sends a generateContent request and returns the decoded JSON text of the first candidate."""
+    await _request_rate_limiter.wait()
+    response = await client.post(
+        f"/v1beta/models/{model_name}:generateContent",
+        content=orjson.dumps(payload),
+        headers={"Content-Type": "application/json"},
+    )
+    response.raise_for_status()
+    reply = orjson.loads(response.content)
+    return orjson.loads(reply["candidates"][0]["content"]["parts"][0]["text"])
+
+async def generate_json_content(client: httpx.AsyncClient, payload: dict, model_name: str = GENERATIVE_MODEL_NAME, cache: diskcache.Cache | None = None):
+    """
+    Sends a generateContent request and returns the model's decoded JSON reply.
+
+    The payload should request a JSON response (responseMimeType
+    'application/json'), so the text of the first candidate can be parsed directly.
+    When a cache is given, identical requests are answered from it, and
+    successful responses are stored in it for GEMINI_CACHE_TTL_SECONDS.
+
+    Args:
+        client (httpx.AsyncClient): A client from create_gemini_client().
+        payload (dict): The request body, in the REST API's JSON format.
+        model_name (str): The model to call.
+        cache (diskcache.Cache | None): A cache from open_response_cache(), if any.
+
+    Returns:
+        The parsed JSON value generated by the model.
+
+    Raises:
+        httpx.HTTPError: If the request fails after retries.
+    """
+    if cache is None:
+        return await _post_generate_content(client, payload, model_name)
+
+    # diskcache is backed by SQLite, so lookups and stores run on a worker
+    # thread rather than blocking the event loop.
+    key = _response_cache_key(model_name, payload)
+    cached = await asyncio.to_thread(cache.get, key)
+    if cached is not None:
+        return cached
+    result = await _post_generate_content(client, payload, model_name)
+    await asyncio.to_thread(cache.set, key, result, expire=GEMINI_CACHE_TTL_SECONDS)
+    return result
+
+def _single_record(result) -> Iterable[dict]:
+    """Turns a result that is one record, or None on failure, into the records to write."""
+    return (result,) if result else ()
+
+async def run_generation(
+    text_chunks: Sequence[str],
+    generate: Callable[..., Awaitable[T]],
+    output_file: str,
+    api_key: str,
+    use_cache: bool = True,
+    desc: str = "Processing text chunks",
+    to_records: Callable[[T], Iterable[dict]] = _single_record,
+) -> int:
+    """
+    Runs a generator function over every chunk and writes the records to a JSONL file.
+
+    Chunks are processed concurrently on a single event loop, with at most
+    MAX_CONCURRENT_REQUESTS in flight. API calls are limited to
+    MAX_REQUESTS_PER_SECOND, but cached responses are not. Records are written
+    in chunk order, in batches of WRITE_BATCH_SIZE lines, so the output is
+    reproducible.
+
+    Args:
+        text_chunks (Sequence[str]): The chunks of source text to process.
+        generate (Callable): An async function called as
+                             generate(text_chunk, client=..., cache=...).
+        output_file (str): Path of the .jsonl (or .jsonl.zst) file to write.
+        api_key (str): The Google API key.
+        use_cache (bool): Whether to reuse cached API responses from earlier runs.
+        desc (str): The label of the progress bar.
+        to_records (Callable): Turns one result of generate() into the records
+                               to write. By default a result is a single
+                               record, or None on failure.
+
+    Returns:
+        int: The number of records written.
+    """
+    records_written = 0
+    # Only this coroutine consumes results, and each flush to the worker thread is
+    # awaited before the next batch is queued, so writes never contend.
+    batch: list[bytes] = []
+    with open_output_file(output_file) as f, open_response_cache(use_cache) as cache:
+        async with create_gemini_client(api_key) as client:
+            # Chunks complete out of order, so each result carries its chunk index.
+            async def _generate(index: int):
+                return index, await generate(text_chunks[index], client=client, cache=cache)
+
+            async with aiometer.amap(
+                _generate,
+                range(len(text_chunks)),
+                max_at_once=MAX_CONCURRENT_REQUESTS,
+            ) as results:
+                # tqdm provides a progress bar for a better user experience with large files.
+                async for result in in_chunk_order(tqdm(results, total=len(text_chunks), desc=desc)):
+                    for record in to_records(result):
+                        batch.append(orjson.dumps(record) + b'\n')
+                        records_written += 1
+                        if len(batch) >= WRITE_BATCH_SIZE:
+                            await asyncio.to_thread(f.write, b''.join(batch))
+                            batch.clear()
+        await asyncio.to_thread(f.write, b''.join(batch))
+    return records_written